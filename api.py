@@ -1,15 +1,26 @@
 import json
 import logging
-import uuid
-from io import StringIO
-from queue import Queue, Empty
-from threading import Thread, Event
+import io
+import secrets
+from queue import Empty, Queue
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
 from urllib.parse import urlparse, unquote_plus
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+import re
 import sys
+import time
 
 from flask import Flask, request, render_template, jsonify, Response
+from werkzeug.exceptions import RequestEntityTooLarge
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # fall back to the stdlib json module
 
 from edhrec_provider import ClientProvidedEdhrecProvider, ServerEdhrecProvider
 from main import BudgetType, DeckBuilder
@@ -19,98 +30,198 @@ base_dir = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
 template_dir = os.path.join(base_dir, 'templates')
 app = Flask(__name__, template_folder=template_dir)
 
+# Upper bound on request bodies (inventory CSV plus edhrec_data); werkzeug rejects larger bodies before they are parsed
+MAX_UPLOAD_BYTES = int(os.getenv("DECK_MAX_UPLOAD_BYTES", str(16 * 1024 * 1024)))
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
+
+logger = logging.getLogger(__name__)
+
 # Simple in-memory session store for builds
-# build_id -> {queue: Queue(), provider_payload: dict, finished: bool, update_event: Event, cancelled: bool}
+# build_id -> {queue: Queue(), provider_payload: dict, finished: bool, update_event: Event, cancelled: bool, future: Future,
+#              created: float, finished_at: float}
 BUILD_SESSIONS: dict[str, dict] = {}
 
+# Finished sessions are kept this many seconds for late /events reconnects, then reaped
+SESSION_TTL = 300
+SESSION_REAP_INTERVAL = 60
+# New builds are rejected with 503 while this many builds are unfinished (finished sessions awaiting reaping don't count)
+MAX_BUILD_SESSIONS = int(os.getenv("DECK_MAX_SESSIONS", "256"))
+
+# Builds run on a fixed-size pool so concurrent /start requests queue up instead of spawning unbounded threads
+BUILDER_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("DECK_WORKERS", "8")), thread_name_prefix="deckbuilder")
+
+# Shared HTTP session for upstream EDHRec fetches; keeps connections (and TLS sessions) alive between requests
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=Retry(total=2, backoff_factor=0.2)))
+
+# Cached edhrec Next.js build id, refreshed at most every _BUILD_ID_TTL seconds
+_BUILD_ID_CACHE = {"value": None, "ts": 0.0}
+_BUILD_ID_TTL = 600
+_BUILD_ID_LOCK = Lock()
+_NEXT_DATA_RE = re.compile(rb'<script id="__NEXT_DATA__" type="application/json">(.*?)</script>', re.S)
+
+# Shared server-side provider, created on first use (see _get_server_provider)
+_SERVER_PROVIDER: ServerEdhrecProvider | None = None
+_SERVER_PROVIDER_LOCK = Lock()
+
+# Upper bound on bodies relayed by /proxy
+PROXY_MAX_BYTES = 10 * 1024 * 1024
+PROXY_CHUNK_SIZE = 64 * 1024
+
+_ALLOWED_EXTENSIONS = (".csv",)
+_BUDGET_TYPES = BudgetType.__members__
+
+# Queued after a build's last event so /events can block on the queue instead of polling it
+STREAM_DONE = "__DONE__"
+# Progress messages queued within this many seconds of each other are sent as a single SSE frame
+PROGRESS_BATCH_WINDOW = 0.05
+
+
+def _get_server_provider() -> ServerEdhrecProvider:
+    """Return the process-wide ServerEdhrecProvider, creating it on first use.
+    The provider only wraps a pyedhrec client, so it is shared across builds instead of rebuilt per request.
+    """
+    global _SERVER_PROVIDER
+    with _SERVER_PROVIDER_LOCK:
+        if _SERVER_PROVIDER is None:
+            _SERVER_PROVIDER = ServerEdhrecProvider()
+        return _SERVER_PROVIDER
+
+
+def _new_session() -> dict:
+    """Return a fresh build session."""
+    return {"queue": Queue(), "provider_payload": {}, "update_event": Event(), "finished": False, "cancelled": False,
+            "created": time.monotonic()}
+
+
+def _active_session_count() -> int:
+    """Number of registered builds that have not finished yet."""
+    # snapshot the values; other request threads may add sessions while we count
+    return sum(1 for session in list(BUILD_SESSIONS.values()) if not session["finished"])
+
+
+def _finish_session(session: dict) -> None:
+    """Mark a session finished and end its event stream."""
+    session["finished_at"] = time.monotonic()
+    session["finished"] = True
+    session["queue"].put((STREAM_DONE, None))
+
+
+def _reap_sessions() -> None:
+    """Periodically drop finished sessions so BUILD_SESSIONS does not grow without bound."""
+    while True:
+        time.sleep(SESSION_REAP_INTERVAL)
+        now = time.monotonic()
+        for build_id, session in list(BUILD_SESSIONS.items()):
+            if session["finished"] and now - session["finished_at"] > SESSION_TTL:
+                BUILD_SESSIONS.pop(build_id, None)
+
+
+# Started at import so it also runs when the app is served by a WSGI server
+Thread(target=_reap_sessions, name="session-reaper", daemon=True).start()
+
 
 @app.route("/", methods=["GET"])
 def index():
     return render_template("index.html")
 
 
-def sse_format(event: str, data: dict) -> str:
-    payload = json.dumps(data)
-    return f"event: {event}\ndata: {payload}\n\n"
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    return jsonify({"error": "Upload too large"}), 413
+
+
+def json_loads(data: str | bytes):
+    """Parse JSON from str or bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(data) -> bytes:
+    """Serialize to UTF-8 encoded JSON bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data).encode("utf-8")
+
+
+def sse_format(event: str, data: dict) -> bytes:
+    return b"event: " + event.encode("utf-8") + b"\ndata: " + json_dumps(data) + b"\n\n"
 
 
 @app.route("/start", methods=["POST"])
 def start_build():
-    inventory = request.files.get("inventory")
+    if (request.content_length or 0) > MAX_UPLOAD_BYTES:
+        return jsonify({"error": "Upload too large"}), 413
+    if _active_session_count() >= MAX_BUILD_SESSIONS:
+        return jsonify({"error": "Too many builds in progress, please try again shortly"}), 503
+
+    # Run the cheap checks first so rejected requests never pay for decoding the (possibly multi-MB) edhrec_data JSON
     commander = request.form.get("commander")
-    partner = request.form.get("partner") or None
-    theme = request.form.get("theme") or None
-    budget = request.form.get("budget") or None
-    edhrec_data = request.form.get("edhrec_data")
+    if not commander:
+        return jsonify({"error": "Commander is required"}), 400
 
+    inventory = request.files.get("inventory")
     if not inventory:
         return jsonify({"error": "No inventory file provided"}), 400
-    if not commander:
-        return jsonify({"error": "Commander is required"}), 400
-    if not inventory.filename or not inventory.filename.endswith(".csv"):
+    if not (inventory.filename or "").lower().endswith(_ALLOWED_EXTENSIONS):
         return jsonify({"error": "Invalid file format. Please upload a CSV file."}), 400
 
-    build_id = str(uuid.uuid4())
-    session = {"queue": Queue(), "provider_payload": {}, "finished": False, "update_event": Event(), "cancelled": False}
-    BUILD_SESSIONS[build_id] = session
+    budget_raw = (request.form.get("budget") or "").upper()
+    budget_type = _BUDGET_TYPES.get(budget_raw) if budget_raw else BudgetType.REGULAR
+    if budget_type is None:
+        return jsonify({"error": f"Invalid budget option: {budget_raw}"}), 400
+
+    partner = request.form.get("partner") or None
+    theme = request.form.get("theme") or None
 
-    # if client provided edhrec_data upfront, store it
+    # if client provided edhrec_data upfront, parse it once and hand it to the builder
+    edhrec_payload = None
+    edhrec_data = request.form.get("edhrec_data")
     if edhrec_data:
         try:
-            # keep for informational purposes; provider selection is below
-            parsed = json.loads(edhrec_data)
+            edhrec_payload = json_loads(edhrec_data)
         except Exception:
-            logging.getLogger(__name__).exception("Invalid edhrec_data JSON")
+            logger.exception("Invalid edhrec_data JSON")
             return jsonify({"error": "Invalid edhrec_data JSON"}), 400
 
-    budget_raw = (budget or "").upper()
+    # Choose provider: if client supplied edhrec_data use client provider, else use server-side provider
+    if edhrec_payload is not None:
+        provider = ClientProvidedEdhrecProvider(edhrec_payload)
+    else:
+        try:
+            provider = _get_server_provider()
+        except Exception as e:
+            logger.exception("Server EDHRec provider initialization failed")
+            return jsonify({"error": f"Server EDHRec provider unavailable: {e}"}), 503
 
-    try:
-        budget_type = BudgetType[budget_raw] if budget_raw else BudgetType.REGULAR
-    except KeyError:
-        return jsonify({"error": f"Invalid budget option: {budget_raw}"}), 400
+    build_id = secrets.token_hex(16)
+    session = _new_session()
+
+    def progress_callback(msg: str):
+        if session.get("cancelled"):
+            return
+        session["queue"].put(("progress", {"message": msg}))
 
+    # The inventory is parsed while constructing the builder. Werkzeug closes uploaded files once the
+    # request ends, so stream-decode the upload here rather than in the background thread.
     try:
-        inventory_bytes = inventory.read()
-        inventory_content = StringIO(inventory_bytes.decode("utf-8"))
+        inventory_content = io.TextIOWrapper(inventory.stream, encoding="utf-8", newline="")
+        builder = DeckBuilder(inventory_content, edhrec_provider=provider, progress_callback=progress_callback)
     except Exception:
+        logger.exception("Failed to read inventory file")
         return jsonify({"error": "Failed to read inventory file"}), 400
 
+    BUILD_SESSIONS[build_id] = session
+
     # Start builder in a background thread; it will push messages into session['queue']
     def run_builder():
         try:
             # if cancelled before start, exit early
             if session.get("cancelled"):
                 session["queue"].put(("cancelled", {"message": "Build cancelled by user"}))
-                session["finished"] = True
                 return
 
-            # Choose provider: if client supplied edhrec_data use client provider, else use server-side provider
-            provider = None
-            if edhrec_data:
-                try:
-                    payload = json.loads(edhrec_data)
-                    provider = ClientProvidedEdhrecProvider(payload)
-                except Exception:
-                    logging.getLogger(__name__).exception("Invalid edhrec_data JSON in run_builder")
-                    session["queue"].put(("error", {"message": "Invalid edhrec_data JSON provided"}))
-                    session["finished"] = True
-                    return
-            else:
-                try:
-                    provider = ServerEdhrecProvider()
-                except Exception as e:
-                    logging.getLogger(__name__).exception("Server EDHRec provider initialization failed")
-                    session["queue"].put(("error", {"message": f"Server EDHRec provider unavailable: {e}"}))
-                    session["finished"] = True
-                    return
-
-            def progress_callback(msg: str):
-                if session.get("cancelled"):
-                    return
-                session["queue"].put(("progress", {"message": msg}))
-
-            builder = DeckBuilder(inventory_content, edhrec_provider=provider, progress_callback=progress_callback)
             try:
                 result = builder.build(commander, partner, (theme.lower() if theme else None), budget_type)
                 if session.get("cancelled"):
@@ -118,12 +229,12 @@ def start_build():
                 else:
                     session["queue"].put(("result", {"result": result}))
             except Exception as e:
-                logging.getLogger(__name__).exception("Builder failed")
+                logger.exception("Builder failed")
                 session["queue"].put(("error", {"message": str(e)}))
         finally:
-            session["finished"] = True
+            _finish_session(session)
 
-    Thread(target=run_builder, daemon=True).start()
+    session["future"] = BUILDER_POOL.submit(run_builder)
 
     # Return build id; client should open an EventSource to /events?build_id=<id>
     return jsonify({"build_id": build_id})
@@ -139,23 +250,41 @@ def events():
 
     def event_stream():
         q = session["queue"]
-        # keep streaming until finished and queue emptied
-        while not session["finished"] or not q.empty():
-            try:
-                ev, data = q.get(timeout=0.5)
-                yield sse_format(ev, data)
-            except Empty:
-                continue
+        item = q.get()
+        while item[0] != STREAM_DONE:
+            ev, data = item
+            item = None
+            if ev == "progress":
+                # coalesce progress lines arriving within PROGRESS_BATCH_WINDOW into one frame
+                messages = [data["message"]]
+                deadline = time.monotonic() + PROGRESS_BATCH_WINDOW
+                while (remaining := deadline - time.monotonic()) > 0:
+                    try:
+                        item = q.get(timeout=remaining)
+                    except Empty:
+                        break
+                    if item[0] != "progress":
+                        break
+                    messages.append(item[1]["message"])
+                    item = None
+                data = {"message": messages[-1], "messages": messages}
+            yield sse_format(ev, data)
+            if item is None:
+                item = q.get()
+        # leave the marker in place so a reconnecting client is closed immediately as well
+        q.put((STREAM_DONE, None))
         yield sse_format("closed", {"message": "Build finished"})
 
-    return Response(event_stream(), mimetype="text/event-stream")
+    # Stop reverse proxies (nginx, CDNs) from buffering the stream, which would delay progress and large result frames
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(event_stream(), mimetype="text/event-stream", headers=headers)
 
 
 @app.route("/update", methods=["POST"])
 def update_build():
     # Accept JSON body {build_id:..., edhrec_payload: {...}}
     try:
-        payload = request.get_json(force=True)
+        payload = json_loads(request.get_data())
     except Exception:
         return jsonify({"error": "Invalid JSON payload"}), 400
 
@@ -179,7 +308,7 @@ def update_build():
 @app.route("/cancel", methods=["POST"])
 def cancel_build():
     try:
-        payload = request.get_json(force=True)
+        payload = json_loads(request.get_data())
     except Exception:
         return jsonify({"error": "Invalid JSON payload"}), 400
 
@@ -193,6 +322,9 @@ def cancel_build():
     session["update_event"].set()
     # notify client stream
     session["queue"].put(("cancelled", {"message": "Build cancelled by user"}))
+    # drop the build if it is still waiting for a pool worker; no builder will end the stream in that case
+    if session["future"].cancel():
+        _finish_session(session)
     return jsonify({"status": "cancelled"})
 
 
@@ -209,55 +341,96 @@ def proxy():
         allowed_hosts = {"json.edhrec.com", "edhrec.com"}
         if host not in allowed_hosts:
             return jsonify({"error": "Host not allowed"}), 403
-        # fetch the URL server-side
-        resp = requests.get(url, timeout=10)
+        # fetch the URL server-side and relay it in chunks rather than buffering the whole body
+        resp = HTTP_SESSION.get(url, timeout=10, stream=True)
         content_type = resp.headers.get('Content-Type', 'application/json')
-        if resp.status_code != 200:
-            return (resp.text, resp.status_code, {'Content-Type': content_type})
-        return (resp.content, 200, {'Content-Type': content_type})
+        try:
+            content_length = int(resp.headers.get('Content-Length') or 0)
+        except ValueError:
+            # malformed header: treat the length as unknown and rely on the cap enforced while relaying
+            content_length = 0
+        if content_length > PROXY_MAX_BYTES:
+            resp.close()
+            return jsonify({"error": "Upstream response too large"}), 502
+
+        def relay():
+            total = 0
+            for chunk in resp.iter_content(PROXY_CHUNK_SIZE):
+                total += len(chunk)
+                if total > PROXY_MAX_BYTES:
+                    # abort the stream instead of ending it cleanly, so the client cannot take a cut-off body as complete
+                    logger.error("Proxy response for %s exceeded %d bytes; aborting", url, PROXY_MAX_BYTES)
+                    raise RuntimeError("Upstream response too large")
+                yield chunk
+
+        response = Response(relay(), status=resp.status_code, content_type=content_type)
+        # runs even if the client goes away before the body is iterated, returning the connection to HTTP_SESSION's pool
+        response.call_on_close(resp.close)
+        return response
     except requests.RequestException as e:
-        logging.getLogger(__name__).exception("Proxy request failed")
+        logger.exception("Proxy request failed")
         return jsonify({"error": f"Proxy fetch failed: {e}"}), 502
 
 
+def _cached_build_id() -> str | None:
+    """Return the cached edhrec build id if it is still fresh."""
+    if _BUILD_ID_CACHE["value"] and time.monotonic() - _BUILD_ID_CACHE["ts"] < _BUILD_ID_TTL:
+        return _BUILD_ID_CACHE["value"]
+    return None
+
+
 @app.route("/edhrec_build_id", methods=["GET"])
 def edhrec_build_id():
     """Return the current edhrec Next.js build id by scraping the homepage's __NEXT_DATA__ script block.
     This matches pyedhrec. Returns JSON { build_id: "..." } or 502 on failure.
+    The build id only changes when edhrec deploys, so it is cached for _BUILD_ID_TTL seconds.
     """
-    try:
-        resp = requests.get("https://edhrec.com", timeout=10)
-        resp.raise_for_status()
-        text = resp.text
-        import re, json as _json
-        m = re.search(r"<script id=\"__NEXT_DATA__\" type=\"application/json\">(.*?)</script>", text, re.S)
-        if not m:
-            return jsonify({"error": "Could not find NEXT_DATA"}), 502
-        props_str = m.group(1)
-        try:
-            props = _json.loads(props_str)
-            build_id = props.get("buildId")
-            if not build_id:
-                return jsonify({"error": "buildId not found in NEXT_DATA"}), 502
+    build_id = _cached_build_id()
+    if build_id:
+        return jsonify({"build_id": build_id})
+
+    # Only one request refreshes the cache; concurrent callers wait and reuse its result
+    with _BUILD_ID_LOCK:
+        build_id = _cached_build_id()
+        if build_id:
             return jsonify({"build_id": build_id})
-        except _json.JSONDecodeError:
-            return jsonify({"error": "Failed to parse NEXT_DATA"}), 502
-    except requests.RequestException as e:
-        logging.getLogger(__name__).exception("Failed to fetch edhrec homepage for build id")
-        return jsonify({"error": str(e)}), 502
+        try:
+            resp = HTTP_SESSION.get("https://edhrec.com", timeout=10)
+            resp.raise_for_status()
+            # search the raw bytes so the whole HTML page is never decoded to str
+            m = _NEXT_DATA_RE.search(resp.content)
+            if not m:
+                return jsonify({"error": "Could not find NEXT_DATA"}), 502
+            props_str = m.group(1)
+            try:
+                props = json_loads(props_str)
+                build_id = props.get("buildId")
+                if not build_id:
+                    return jsonify({"error": "buildId not found in NEXT_DATA"}), 502
+                _BUILD_ID_CACHE["value"] = build_id
+                _BUILD_ID_CACHE["ts"] = time.monotonic()
+                return jsonify({"build_id": build_id})
+            except json.JSONDecodeError:
+                return jsonify({"error": "Failed to parse NEXT_DATA"}), 502
+        except requests.RequestException as e:
+            logger.exception("Failed to fetch edhrec homepage for build id")
+            return jsonify({"error": str(e)}), 502
+
+
+# Tiny SVG favicon, encoded once at import
+FAVICON_BYTES = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<svg xmlns="http://www.w3.org/2000/svg" width="64" height="64" viewBox="0 0 64 64">'
+    '<rect width="100%" height="100%" fill="#1f6feb"/>'
+    '<text x="32" y="38" font-size="36" text-anchor="middle" fill="white" font-family="Segoe UI, Roboto, Arial">D</text>'
+    '</svg>'
+).encode("utf-8")
 
 
 @app.route('/favicon.ico')
 def favicon():
     """Serve a tiny SVG favicon to avoid 404s from browsers requesting /favicon.ico."""
-    svg = (
-        '<?xml version="1.0" encoding="UTF-8"?>'
-        '<svg xmlns="http://www.w3.org/2000/svg" width="64" height="64" viewBox="0 0 64 64">'
-        '<rect width="100%" height="100%" fill="#1f6feb"/>'
-        '<text x="32" y="38" font-size="36" text-anchor="middle" fill="white" font-family="Segoe UI, Roboto, Arial">D</text>'
-        '</svg>'
-    )
-    return Response(svg, mimetype='image/svg+xml')
+    return Response(FAVICON_BYTES, mimetype='image/svg+xml', headers={'Cache-Control': 'public, max-age=604800, immutable'})
 
 
 if __name__ == "__main__":
@@ -265,5 +438,8 @@ if __name__ == "__main__":
         level=logging.INFO,
         format="%(asctime)s - %(levelname)s - %(message)s",
     )
-    # For local development run with: python api.py
-    app.run(host="0.0.0.0", port=8000, debug=True)
+    # For local development run with: FLASK_DEBUG=1 python api.py
+    # In production serve with a threaded WSGI server. Build sessions live in memory, so keep a single worker process:
+    #   gunicorn --workers 1 --worker-class gthread --threads 8 --bind 0.0.0.0:8000 api:app
+    debug = os.getenv("FLASK_DEBUG") == "1"
+    app.run(host="0.0.0.0", port=8000, debug=debug, threaded=True)
@@ -1,10 +1,45 @@
-from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import re
+from threading import Lock
+import time
+from typing import Any, Callable
+
+import requests
+from requests.adapters import HTTPAdapter
 
 try:
     from pyedhrec import EDHRec
 except Exception:
     EDHRec = None  # runtime import error will be surfaced when used
 
+# Average-deck lines look like '2 Card Name'
+_DECK_LINE_RE = re.compile(r"(\d+) (.+)", re.S)
+
+# Concurrent EDHRec requests used by the *_bulk helpers, shared by every build in the process
+_BULK_FETCH_WORKERS = 8
+_BULK_FETCH_POOL = ThreadPoolExecutor(max_workers=_BULK_FETCH_WORKERS, thread_name_prefix="edhrec-fetch")
+# Keep-alive connections held by pyedhrec's session: the bulk pool plus builder threads fetching directly
+_EDHREC_POOL_MAXSIZE = 32
+
+# Cached EDHRec lookups are refetched after this many seconds; EDHRec refreshes its data about once a day
+_CACHE_TTL = 6 * 60 * 60
+
+# After a 404, pyedhrec's Next.js build id is re-resolved at most this often (unknown cards 404 too)
+_BUILD_ID_RETRY_INTERVAL = 60
+
+# pyedhrec helper used to fetch the top cards of each card type
+_TOP_CARDS_METHODS = {
+    "Creature": "get_top_creatures",
+    "Sorcery": "get_top_sorceries",
+    "Land": "get_top_lands",
+    "Instant": "get_top_instants",
+    "Enchantment": "get_top_enchantments",
+    "Artifact": "get_top_artifacts",
+    "Planeswalker": "get_top_planeswalkers",
+    "Battle": "get_top_battles",
+}
+
 
 class ClientProvidedEdhrecProvider:
     """
@@ -45,16 +80,28 @@ class ClientProvidedEdhrecProvider:
         top_cards_by_type = self.payload.get("top_cards_by_type", {})
         return top_cards_by_type.get(card_type, [])
 
+    def get_top_cards_bulk(self, commander_name: str, card_types: list[str]) -> dict[str, list[dict[str, Any]]]:
+        top_cards_by_type = self.payload.get("top_cards_by_type", {})
+        return {card_type: top_cards_by_type.get(card_type, []) for card_type in card_types}
+
     def get_similar(self, card_name: str) -> list[dict[str, Any]]:
         similar = self.payload.get("similar", {})
         return similar.get(card_name, [])
 
+    def get_similar_bulk(self, card_names: list[str]) -> dict[str, list[dict[str, Any]]]:
+        similar = self.payload.get("similar", {})
+        return {name: similar.get(name, []) for name in card_names}
+
     def get_card_details(self, card_name: str) -> dict[str, Any]:
         details = self.payload.get("card_details", {})
         if card_name in details:
             return details[card_name]
         raise KeyError(f"Missing card details for '{card_name}' in provided EDHRec payload")
 
+    def get_card_details_bulk(self, card_names: list[str]) -> dict[str, dict[str, Any]]:
+        details = self.payload.get("card_details", {})
+        return {name: details[name] for name in card_names if name in details}
+
 
 class ServerEdhrecProvider:
     """Provider that performs EDHRec calls server-side using pyedhrec."""
@@ -63,23 +110,82 @@ class ServerEdhrecProvider:
         if EDHRec is None:
             raise RuntimeError("pyedhrec is required for server-side EDHRec provider; install pyedhrec in requirements.txt")
         self.edhrec = EDHRec()
+        # requests' default adapter keeps only 10 connections per host and drops the rest after use
+        self.edhrec.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=_EDHREC_POOL_MAXSIZE))
+        # Guards pyedhrec's current_build_id, see _with_build_id
+        self._build_id_lock = Lock()
+        self._build_id_resolved_at = 0.0
+        self._current_ttl_bucket = int(time.monotonic() // _CACHE_TTL)
+        # Memoize the EDHRec fetches per instance. The API keeps a single provider for all server-side builds, so
+        # repeated commanders and cards are served from memory instead of the network. Callers treat results as read-only.
+        # The _fetch_* helpers raise on failure, so errors are never cached. The trailing ttl_bucket argument changes
+        # every _CACHE_TTL seconds so older entries stop matching; _ttl_bucket also drops pyedhrec's build id at that
+        # point, so the refetches use EDHRec's current deploy rather than the id resolved when the client was created.
+        self._cached_avg_deck = lru_cache(maxsize=256)(self._fetch_avg_deck)
+        self._cached_top_cards = lru_cache(maxsize=1024)(self._fetch_top_cards)
+        self._cached_similar = lru_cache(maxsize=1024)(self._fetch_similar)
+        self._cached_card_details = lru_cache(maxsize=1024)(self._fetch_card_details)
+
+    def _ttl_bucket(self) -> int:
+        bucket = int(time.monotonic() // _CACHE_TTL)
+        if bucket != self._current_ttl_bucket:
+            with self._build_id_lock:
+                if bucket != self._current_ttl_bucket:
+                    self._current_ttl_bucket = bucket
+                    self.edhrec.current_build_id = None
+        return bucket
+
+    def _warm_build_id(self) -> None:
+        """Resolve pyedhrec's Next.js build id once, so concurrent fetches don't each scrape the EDHRec homepage."""
+        if self.edhrec.current_build_id is None:
+            with self._build_id_lock:
+                if self.edhrec.current_build_id is None:
+                    self.edhrec.check_build_id()
+                    self._build_id_resolved_at = time.monotonic()
+
+    def _with_build_id(self, fetch: Callable[[], Any]) -> Any:
+        """Run a pyedhrec fetch of a _next/data URL, re-resolving the build id and retrying once on 404.
+        pyedhrec looks the build id up only once per client (falling back to a hard-coded id if that fails), while
+        EDHRec changes it on every deploy, after which every _next/data URL built with the old id returns 404.
+        """
+        self._warm_build_id()
+        stale = self.edhrec.current_build_id
+        try:
+            return fetch()
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+            with self._build_id_lock:
+                if self.edhrec.current_build_id == stale:
+                    # a just-resolved id is trusted; the 404 is then most likely an unknown card
+                    if time.monotonic() - self._build_id_resolved_at < _BUILD_ID_RETRY_INTERVAL:
+                        raise
+                    self.edhrec.current_build_id = None
+            self._warm_build_id()
+            if self.edhrec.current_build_id == stale:
+                raise
+            return fetch()
 
     def get_avg_deck(self, commander_name: str, theme: str | None, budget_type) -> dict[str, int]:
+        return self._cached_avg_deck(commander_name, theme, budget_type, self._ttl_bucket())
+
+    def _fetch_avg_deck(self, commander_name: str, theme: str | None, budget_type, ttl_bucket: int) -> dict[str, int]:
         # Mirrors old_main.get_commanders_average_deck_with_theme
-        average_deck_uri, params = self.edhrec._build_nextjs_uri("average-decks", commander_name, theme=theme, budget=budget_type.value if hasattr(budget_type, 'value') else budget_type)
-        res = self.edhrec._get(average_deck_uri, query_params=params)
-        data = self.edhrec._get_nextjs_data(res)
+        def fetch():
+            average_deck_uri, params = self.edhrec._build_nextjs_uri("average-decks", commander_name, theme=theme, budget=budget_type.value if hasattr(budget_type, 'value') else budget_type)
+            res = self.edhrec._get(average_deck_uri, query_params=params)
+            return self.edhrec._get_nextjs_data(res)
+
+        data = self._with_build_id(fetch)
         deck = data.get("deck") or []
         # deck may be list of strings like '2 Card Name' or list of dicts
         result = {}
         if isinstance(deck, list):
             for item in deck:
                 if isinstance(item, str):
-                    parts = item.split(' ')
-                    if parts and parts[0].isdigit():
-                        qty = int(parts[0])
-                        name = ' '.join(parts[1:])
-                        result[name] = qty
+                    m = _DECK_LINE_RE.fullmatch(item)
+                    if m:
+                        result[m.group(2)] = int(m.group(1))
                 elif isinstance(item, dict) and 'name' in item and 'count' in item:
                     result[item['name']] = int(item['count'])
         elif isinstance(deck, dict):
@@ -97,100 +203,123 @@ class ServerEdhrecProvider:
 
     def get_top_cards_for_type(self, commander_name: str, card_type: str) -> list[dict[str, Any]]:
         # Map type to pyedhrec helper methods where possible
+        if card_type not in _TOP_CARDS_METHODS:
+            return []
         try:
-            raw = None
-            match card_type:
-                case "Creature":
-                    raw = self.edhrec.get_top_creatures(commander_name)
-                case "Sorcery":
-                    raw = self.edhrec.get_top_sorceries(commander_name)
-                case "Land":
-                    raw = self.edhrec.get_top_lands(commander_name)
-                case "Instant":
-                    raw = self.edhrec.get_top_instants(commander_name)
-                case "Enchantment":
-                    raw = self.edhrec.get_top_enchantments(commander_name)
-                case "Artifact":
-                    raw = self.edhrec.get_top_artifacts(commander_name)
-                case "Planeswalker":
-                    raw = self.edhrec.get_top_planeswalkers(commander_name)
-                case "Battle":
-                    raw = self.edhrec.get_top_battles(commander_name)
-                case _:
-                    raw = []
-
-            # Normalize raw into a list[dict] where each dict has at least {'name': ...}
-            def normalize_item(item):
-                # if item is a string, treat as name
-                if isinstance(item, str):
-                    return {"name": item}
-                if isinstance(item, dict):
-                    # common shape: {'name': 'Foo', ...}
-                    if 'name' in item:
-                        return item
-                    # sometimes it's keyed by name: {'Foo': {...}}
-                    if len(item) == 1:
-                        k, v = next(iter(item.items()))
-                        if isinstance(v, dict):
-                            out = dict(v)
-                            out['name'] = k
-                            return out
-                    # fallback: return as-is
-                    return item
-                # unknown -> None
-                return None
-
-            out_list: list[dict[str, Any]] = []
-            if raw is None:
-                return []
-
-            if isinstance(raw, list):
-                for it in raw:
-                    ni = normalize_item(it)
-                    if ni:
-                        out_list.append(ni)
-                return out_list
+            return self._cached_top_cards(commander_name, card_type, self._ttl_bucket())
+        except Exception:
+            return []
+
+    def _fetch_top_cards(self, commander_name: str, card_type: str, ttl_bucket: int) -> list[dict[str, Any]]:
+        top_cards_method = getattr(self.edhrec, _TOP_CARDS_METHODS[card_type])
+        raw = self._with_build_id(lambda: top_cards_method(commander_name))
 
-            if isinstance(raw, dict):
-                # If dict values are lists, flatten them
-                for v in raw.values():
-                    if isinstance(v, list):
-                        for it in v:
-                            ni = normalize_item(it)
-                            if ni:
-                                out_list.append(ni)
-                        if out_list:
-                            return out_list
-                # Otherwise, try to interpret keys as names
-                for k, v in raw.items():
+        # Normalize raw into a list[dict] where each dict has at least {'name': ...}
+        def normalize_item(item):
+            # if item is a string, treat as name
+            if isinstance(item, str):
+                return {"name": item}
+            if isinstance(item, dict):
+                # common shape: {'name': 'Foo', ...}
+                if 'name' in item:
+                    return item
+                # sometimes it's keyed by name: {'Foo': {...}}
+                if len(item) == 1:
+                    k, v = next(iter(item.items()))
                     if isinstance(v, dict):
-                        ni = dict(v)
-                        ni.setdefault('name', k)
-                        out_list.append(ni)
-                    elif isinstance(v, str):
-                        out_list.append({'name': v})
-                if out_list:
-                    return out_list
-
-            # unknown shape -> empty
+                        out = dict(v)
+                        out['name'] = k
+                        return out
+                # fallback: return as-is
+                return item
+            # unknown -> None
+            return None
+
+        out_list: list[dict[str, Any]] = []
+        if raw is None:
             return []
+
+        if isinstance(raw, list):
+            for it in raw:
+                ni = normalize_item(it)
+                if ni:
+                    out_list.append(ni)
+            return out_list
+
+        if isinstance(raw, dict):
+            # If dict values are lists, flatten them
+            for v in raw.values():
+                if isinstance(v, list):
+                    for it in v:
+                        ni = normalize_item(it)
+                        if ni:
+                            out_list.append(ni)
+                    if out_list:
+                        return out_list
+            # Otherwise, try to interpret keys as names
+            for k, v in raw.items():
+                if isinstance(v, dict):
+                    ni = dict(v)
+                    ni.setdefault('name', k)
+                    out_list.append(ni)
+                elif isinstance(v, str):
+                    out_list.append({'name': v})
+            if out_list:
+                return out_list
+
+        # unknown shape -> empty
+        return []
+
+    def get_top_cards_bulk(self, commander_name: str, card_types: list[str]) -> dict[str, list[dict[str, Any]]]:
+        # One EDHRec request per card type, so overlap them like get_similar_bulk
+        if not card_types:
+            return {}
+        self._prepare_fan_out()
+        return dict(zip(card_types, _BULK_FETCH_POOL.map(
+            lambda card_type: self.get_top_cards_for_type(commander_name, card_type), card_types)))
+
+    def get_similar(self, card_name: str) -> list[dict[str, Any]]:
+        try:
+            return self._cached_similar(card_name, self._ttl_bucket())
         except Exception:
             return []
 
-    def get_similar(self, card_name: str) -> list[dict[str, Any]]:
+    def _fetch_similar(self, card_name: str, ttl_bucket: int) -> list[dict[str, Any]]:
         # Mirrors old_main.get_similar
-        try:
+        def fetch():
             card_name_fixed = card_name
             average_deck_uri, params = self.edhrec._build_nextjs_uri("cards", card_name_fixed, card_name_fixed)
             params.pop("commanderName", None)
             res = self.edhrec._get(average_deck_uri, query_params=params)
-            data = self.edhrec._get_nextjs_data(res)
-            return data.get("similar", [])
+            return self.edhrec._get_nextjs_data(res)
+
+        return self._with_build_id(fetch).get("similar", [])
+
+    def get_similar_bulk(self, card_names: list[str]) -> dict[str, list[dict[str, Any]]]:
+        # Each card is a separate EDHRec page, so overlap the network-bound fetches
+        if not card_names:
+            return {}
+        self._prepare_fan_out()
+        return dict(zip(card_names, _BULK_FETCH_POOL.map(self.get_similar, card_names)))
+
+    def _prepare_fan_out(self) -> None:
+        """Resolve the build id before fetching in parallel, so the workers don't all scrape the homepage at once."""
+        try:
+            self._warm_build_id()
         except Exception:
-            return []
+            pass  # each fetch resolves (and reports failures) on its own
 
     def get_card_details(self, card_name: str) -> dict[str, Any]:
         try:
-            return self.edhrec.get_card_details(card_name)
+            return self._cached_card_details(card_name, self._ttl_bucket())
         except Exception as e:
             raise KeyError(str(e))
+
+    def _fetch_card_details(self, card_name: str, ttl_bucket: int) -> dict[str, Any]:
+        return self.edhrec.get_card_details(card_name)
+
+    def get_card_details_bulk(self, card_names: list[str]) -> dict[str, dict[str, Any]]:
+        # One card-list request instead of a details request per card; names missing from the
+        # response (or returned without a type) are left for the caller to fetch individually
+        cards = self.get_card_list(card_names).get("cards") or {}
+        return {name: cards[name] for name in card_names if isinstance(cards.get(name), dict) and "type" in cards[name]}
@@ -1,13 +1,22 @@
 import csv
 import logging
-import random
 from collections import defaultdict
 from enum import Enum
+from random import randrange
+from functools import lru_cache
 from typing import Any, TextIO, Callable
-from typing import Any as TypeAny
 
-from unidecode import unidecode
-from edhrec_provider import ClientProvidedEdhrecProvider
+from unidecode import unidecode as _unidecode
+
+# Card names recur across inventory rows, average decks and similar-card lookups; memoize their transliteration
+_cached_unidecode = lru_cache(maxsize=16384)(_unidecode)
+
+
+# Deliberately shadows the library unidecode so every call in this module goes through the cache
+def unidecode(text: str) -> str:
+    # Most card names are plain ASCII and transliterate to themselves; only cache the ones that need work
+    return text if text.isascii() else _cached_unidecode(text)
+
 
 COLOR_TO_BASIC_LAND = {
     "W": "Plains",
@@ -16,6 +25,23 @@ COLOR_TO_BASIC_LAND = {
     "R": "Mountain",
     "G": "Forest",
 }
+BASIC_LANDS = frozenset(COLOR_TO_BASIC_LAND.values())
+
+# Color identities are handled as WUBRG bitmasks so subset checks are a single integer AND
+COLOR_BITS = {color: 1 << i for i, color in enumerate(COLOR_TO_BASIC_LAND)}
+# Colors present in each of the 32 possible color identity masks
+COLORS_BY_BITS = tuple(tuple(color for color, bit in COLOR_BITS.items() if mask & bit) for mask in range(1 << len(COLOR_BITS)))
+
+
+def color_identity_bits(color_identity) -> int:
+    bits = 0
+    for color in color_identity:
+        bits |= COLOR_BITS.get(color, 0)
+    return bits
+
+
+# Owned high-synergy cards reported per card type beyond the ones used as replacements
+EXTRA_CARDS_LIMIT = 20
 
 
 class BudgetType(Enum):
@@ -36,12 +62,14 @@ class CardType(Enum):
 
 
 class DeckBuilder:
-    def __init__(self, inventory_file: TextIO, edhrec_provider: TypeAny, progress_callback: Callable[[str], None] = None):
+    def __init__(self, inventory_file: TextIO, edhrec_provider: Any, progress_callback: Callable[[str], None] = None):
         # edhrec_provider may be any object implementing the expected methods (ClientProvidedEdhrecProvider is typical)
         self.edhrec_provider = edhrec_provider
         self.inventory = self.get_inventory(inventory_file)
         self.logger = logging.getLogger(__name__)
         self.progress_callback = progress_callback
+        # card name -> EDHRec-friendly name, see _fix_card_name
+        self._fix_cache: dict[str, str] = {}
 
     def _log(self, message: str) -> None:
         """Log to logger and forward progress to callback if provided."""
@@ -53,13 +81,14 @@ class DeckBuilder:
                 # keep builder robust if callback fails
                 self.logger.exception("Progress callback failed")
 
-    def get_inventory(self, inventory_file) -> dict[str, dict[str, str]]:
-        inventory: dict[str, dict[str, str]] = dict()
-        reader = csv.DictReader(inventory_file)
-        for row in reader:
-            inventory[unidecode(row["Name"]).split(" // ")[0]] = row
-
-        return inventory
+    def get_inventory(self, inventory_file) -> set[str]:
+        # The builder only ever checks whether a card is owned, so keep the normalized names and drop the rows
+        reader = csv.reader(inventory_file)
+        header = next(reader, [])
+        if "Name" not in header:
+            raise KeyError("Name")
+        name_idx = header.index("Name")
+        return {unidecode(row[name_idx]).split(" // ", 1)[0] for row in reader if len(row) > name_idx}
 
     def get_avg_budget_deck(self, commander_name: str, theme: str = None) -> dict[str, int]:
         return self.get_avg_deck(commander_name, theme, BudgetType.BUDGET)
@@ -71,11 +100,15 @@ class DeckBuilder:
         return self.edhrec_provider.get_avg_deck(commander_name, theme, budget_type)
 
     def build_new_deck_from_inventory(self, avg_deck: dict[str, int]) -> tuple[dict[str, int], list[str]]:
-        new_deck = dict()
+        new_deck: defaultdict[str, int] = defaultdict(int)
         unavailable_cards = list()
+        # bind loop invariants to locals to avoid repeated global/attribute lookups
+        inventory, basic_lands = self.inventory, BASIC_LANDS
         for name, number in avg_deck.items():
-            if unidecode(name) in self.inventory or name in COLOR_TO_BASIC_LAND.values():
-                new_deck[unidecode(name)] = number
+            # match on the front face like get_inventory, but keep the full name (e.g. 'Fire // Ice') in the deck
+            full_name = unidecode(name)
+            if full_name.split(" // ", 1)[0] in inventory or name in basic_lands:
+                new_deck[full_name] = number
             else:
                 unavailable_cards.append(name)
         return new_deck, unavailable_cards
@@ -83,65 +116,68 @@ class DeckBuilder:
     def _get_deck_size(self, deck: dict[str, int]) -> int:
         return sum(deck.values())
 
-    def sort_cards_by_type(self, card_details_list: dict[str, dict[str, Any]]) -> dict[str, list[str]]:
-        card_detail_groups = defaultdict(list)
+    def sort_cards_by_type(self, card_details_list: dict[str, dict[str, Any]]) -> dict[str, list[dict[str, Any]]]:
+        card_detail_groups: dict[str, list[dict[str, Any]]] = {}
         for name, card_details in card_details_list.items():
-            card_detail_groups[card_details['primary_type']].append(card_details)
+            # skip cards the provider returned without a type (or without details at all)
+            primary_type = card_details.get('primary_type') if card_details else None
+            if primary_type is None:
+                continue
+            card_detail_groups.setdefault(primary_type, []).append(card_details)
 
-        return dict(card_detail_groups)
+        return card_detail_groups
 
     def fill_in_from_high_synergy_cards(self, commander_name: str, unavailable_cards_by_type: dict[str, list[str]], new_deck: dict[str, int]):
         # high_synergy_cards = edhrec.get_high_synergy_cards(commander_name)
         extra_cards_by_type = dict()
+        if not unavailable_cards_by_type:
+            return extra_cards_by_type
+        top_cards_by_type = self.edhrec_provider.get_top_cards_bulk(commander_name, list(unavailable_cards_by_type))
+
         for card_type, missing_cards in unavailable_cards_by_type.items():
-            top_cards = self.get_top_cards_for_card_type(commander_name, card_type)
-            top_cards = list(filter(lambda card: card['name'] not in new_deck and card['name'] in self.inventory, top_cards))
-            replacement_cards, extra_cards = top_cards[0: len(missing_cards)], top_cards[len(missing_cards): len(top_cards)]
+            top_cards = top_cards_by_type[card_type]
+            # take the best owned cards as replacements and keep at most EXTRA_CARDS_LIMIT more as suggestions
+            needed = len(missing_cards)
+            replacement_cards, extra_cards = [], []
+            for card in top_cards:
+                name = card['name']
+                if name in new_deck or name not in self.inventory:
+                    continue
+                if len(replacement_cards) < needed:
+                    replacement_cards.append(card)
+                else:
+                    extra_cards.append(card)
+                    if len(extra_cards) >= EXTRA_CARDS_LIMIT:
+                        break
             extra_cards_by_type[card_type] = extra_cards
             for card in replacement_cards:
                 new_deck[card['name']] = 1
         return extra_cards_by_type
 
-    def get_top_cards_for_card_type(self, commander_name: str, card_type: str) -> list[dict[str, Any]]:
-        top_cards: list[dict[str, Any]] = []
-        match card_type:
-            case CardType.CREATURE.value:
-                top_cards = self.edhrec_provider.get_top_cards_for_type(commander_name, CardType.CREATURE.value)
-            case CardType.SORCERY.value:
-                top_cards = self.edhrec_provider.get_top_cards_for_type(commander_name, CardType.SORCERY.value)
-            case CardType.LAND.value:
-                top_cards = self.edhrec_provider.get_top_cards_for_type(commander_name, CardType.LAND.value)
-            case CardType.INSTANT.value:
-                top_cards = self.edhrec_provider.get_top_cards_for_type(commander_name, CardType.INSTANT.value)
-            case CardType.ENCHANTMENT.value:
-                top_cards = self.edhrec_provider.get_top_cards_for_type(commander_name, CardType.ENCHANTMENT.value)
-            case CardType.ARTIFACT.value:
-                top_cards = self.edhrec_provider.get_top_cards_for_type(commander_name, CardType.ARTIFACT.value)
-            case CardType.PLANESWALKER.value:
-                top_cards = self.edhrec_provider.get_top_cards_for_type(commander_name, CardType.PLANESWALKER.value)
-            case CardType.BATTLE.value:
-                top_cards = self.edhrec_provider.get_top_cards_for_type(commander_name, CardType.BATTLE.value)
-            case _:
-                top_cards = []
-        return top_cards
-
     def get_similar(self, card_name: str) -> dict:
         card_name = self._fix_card_name(card_name)
         return self.edhrec_provider.get_similar(card_name)
 
-    def _is_color_identity_match(self, card_color_identity: list[str], commander_color_identity: list[str]) -> bool:
-        return set(card_color_identity) <= set(commander_color_identity)
+    def _is_color_identity_match(self, card_color_identity: list[str], commander_color_identity: int) -> bool:
+        return color_identity_bits(card_color_identity) & ~commander_color_identity == 0
 
     def find_similar_cards(self, commander: str, partner: str | None, unavailable_cards: list[str], new_deck: dict[str, int]) -> tuple[dict[str, int], list[str]]:
         still_unavailable_cards = []
         commander_color_identity = self._get_color_identity(commander, partner)
-        
-        for counter, unavailable_card in enumerate(unavailable_cards, 1):
+        # Prefetch similar cards and details for every unavailable card up front; details misses fall back to per-card lookups
+        fixed_names = [self._fix_card_name(card) for card in unavailable_cards]
+        if fixed_names:
+            self._log(f"Fetching similar cards for {len(fixed_names)} unavailable cards")
+        similars_by_name = self.edhrec_provider.get_similar_bulk(fixed_names)
+        details_by_name = self.edhrec_provider.get_card_details_bulk(fixed_names)
+
+        for counter, (unavailable_card, fixed_name) in enumerate(zip(unavailable_cards, fixed_names), 1):
             self._log(f"Checking {counter}/{len(unavailable_cards)} - {unavailable_card}")
-            if self._find_similar_card(unavailable_card, commander_color_identity, new_deck):
+            similars = similars_by_name.get(fixed_name, [])
+            if self._find_similar_card(unavailable_card, similars, commander_color_identity, new_deck):
                 continue
 
-            card_details = self.edhrec_provider.get_card_details(self._fix_card_name(unavailable_card))
+            card_details = details_by_name.get(fixed_name) or self.edhrec_provider.get_card_details(fixed_name)
             if card_details["type"] == CardType.LAND.value:
                 self._log(f"{unavailable_card} is a land, replace with Basic Land")
                 self._add_basic_land_to_deck(commander_color_identity, new_deck)
@@ -151,33 +187,35 @@ class DeckBuilder:
 
         return new_deck, still_unavailable_cards
     
-    def _get_color_identity(self, commander: str, partner: str | None) -> list[str]:
-        color_identity = self.edhrec_provider.get_card_details(commander)["color_identity"]
+    def _get_color_identity(self, commander: str, partner: str | None) -> int:
+        color_identity = color_identity_bits(self.edhrec_provider.get_card_details(commander)["color_identity"])
         if partner:
-            partner_color_identity = self.edhrec_provider.get_card_details(partner)["color_identity"]
-            color_identity = list(set(color_identity).union(partner_color_identity))
+            color_identity |= color_identity_bits(self.edhrec_provider.get_card_details(partner)["color_identity"])
         return color_identity
 
-    def _find_similar_card(self, unavailable_card: str, commander_color_identity: list[str], new_deck: dict[str, int]) -> bool:
-        similars = self.get_similar(unavailable_card)
+    def _find_similar_card(self, unavailable_card: str, similars: list[dict[str, Any]], commander_color_identity: int, new_deck: dict[str, int]) -> bool:
+        inventory, is_color_identity_match = self.inventory, self._is_color_identity_match
         for similar in similars:
-            if (self._is_color_identity_match(similar["color_identity"], commander_color_identity) and
-                similar["name"] not in new_deck and similar["name"] in self.inventory):
-                new_deck[similar["name"]] = 1
-                self._log(f"Found {similar['name']} similar to {unavailable_card}")
+            name = similar["name"]
+            # cheap membership tests first; most similar cards are not owned
+            if (name in inventory and name not in new_deck and
+                is_color_identity_match(similar["color_identity"], commander_color_identity)):
+                new_deck[name] = 1
+                self._log(f"Found {name} similar to {unavailable_card}")
                 return True
         return False
     
     def _fix_card_name(self, unavailable_card: str) -> str:
-        return unidecode(unavailable_card).replace(" // ", "-").replace(":" , "")
+        fixed = self._fix_cache.get(unavailable_card)
+        if fixed is None:
+            fixed = unidecode(unavailable_card).replace(" // ", "-").replace(":" , "")
+            self._fix_cache[unavailable_card] = fixed
+        return fixed
 
-    def _add_basic_land_to_deck(self, color_identity: list[str], new_deck: dict[str, int]) -> None:
-        color = random.choice(color_identity)
-        basic_land = COLOR_TO_BASIC_LAND[color]
-        if basic_land in new_deck:
-            new_deck[basic_land] += 1
-        else:
-            new_deck[basic_land] = 1
+    def _add_basic_land_to_deck(self, color_identity: int, new_deck: defaultdict[str, int]) -> None:
+        colors = COLORS_BY_BITS[color_identity]
+        basic_land = COLOR_TO_BASIC_LAND[colors[randrange(len(colors))]]
+        new_deck[basic_land] += 1
 
     def build(self, commander: str, partner: str = None, theme: str = None, budget_type: BudgetType = BudgetType.REGULAR):
         if partner:
@@ -205,7 +243,7 @@ class DeckBuilder:
         self._print_deck(new_deck)
 
         return {
-            "deck": new_deck,
+            "deck": dict(new_deck),
             "deck_size": self._get_deck_size(new_deck),
             "unavailable_cards": unavailable_cards,
             "unavailable_cards_by_type": unavailable_cards_by_type,
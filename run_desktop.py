@@ -13,12 +13,7 @@ import socket
 import threading
 import time
 import sys
-
-# Prefer requests for health checks; fall back to urllib
-try:
-    import requests
-except Exception:
-    requests = None
+from urllib.parse import urlsplit
 
 # Import the Flask app from the project
 try:
@@ -28,6 +23,12 @@ except Exception as e:
     print("Failed to import Flask app from api.py:", e)
     raise
 
+# Prefer waitress over the Werkzeug development server; fall back to flask_app.run
+try:
+    from waitress import serve
+except Exception:
+    serve = None
+
 # optional import of pywebview (may be missing in some builds)
 try:
     import webview
@@ -44,30 +45,27 @@ def find_free_port():
 
 
 def start_flask(port: int):
-    # Start Flask development server in a thread (use_reloader=False)
-    flask_thread = threading.Thread(
-        target=lambda: flask_app.run(host='127.0.0.1', port=port, debug=False, threaded=True, use_reloader=False),
-        daemon=True,
-    )
+    # Serve the Flask app in a thread; waitress uses a worker pool, the dev server is the fallback (use_reloader=False)
+    if serve is not None:
+        target = lambda: serve(flask_app, host='127.0.0.1', port=port, threads=8, _quiet=True)
+    else:
+        target = lambda: flask_app.run(host='127.0.0.1', port=port, debug=False, threaded=True, use_reloader=False)
+    flask_thread = threading.Thread(target=target, daemon=True)
     flask_thread.start()
     return flask_thread
 
 
 def wait_until_up(url, timeout=10.0):
-    start = time.time()
-    while time.time() - start < timeout:
-        try:
-            if requests:
-                r = requests.get(url, timeout=1.0)
-                if r.status_code < 500:
-                    return True
-            else:
-                import urllib.request
-                with urllib.request.urlopen(url, timeout=1.0) as resp:
-                    if resp.status < 500:
-                        return True
-        except Exception:
-            time.sleep(0.1)
+    # A bare TCP connect is enough to know the server is listening and far cheaper than an HTTP GET
+    parts = urlsplit(url)
+    addr = (parts.hostname or '127.0.0.1', parts.port or 80)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.settimeout(0.1)
+            if s.connect_ex(addr) == 0:
+                return True
+        time.sleep(0.02)
     return False
 
 
@@ -22,6 +22,7 @@ a = Analysis(
 
         # Core dependencies
         'flask',
+        'waitress',
         'webview',
         'requests',
         'unidecode',